@@ -0,0 +1,10 @@
+-- AlterTable
+ALTER TABLE "CoordinateLogs" ADD COLUMN     "droneId" TEXT,
+ADD COLUMN     "fixId" TEXT,
+ADD COLUMN     "seq" INTEGER;
+
+-- CreateIndex
+CREATE UNIQUE INDEX "CoordinateLogs_fixId_key" ON "CoordinateLogs"("fixId");
+
+-- CreateIndex
+CREATE INDEX "CoordinateLogs_droneId_seq_idx" ON "CoordinateLogs"("droneId", "seq");
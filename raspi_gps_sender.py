@@ -8,6 +8,7 @@ Features:
 - Auto-reconnection on connection loss
 - Robust error handling
 - Low resource usage
+- Pipelined batch uploads with idempotent retries (sequence numbers + fix IDs)
 - Systemd service compatible
 - Configurable for different hardware setups
 
@@ -39,30 +40,75 @@ from datetime import datetime
 import sys
 import os
 import signal
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 API_URL = "https://server-drone.vercel.app/api/logs"
 SEND_INTERVAL = 0.5  # Send every 0.5 seconds
 MAX_RETRIES = 5  # Max connection retries before giving up
 RETRY_DELAY = 5  # Seconds between retry attempts
+UPLOAD_WINDOW = 4  # Max batches in flight at once
+BATCH_SIZE = 20  # Max points per batch request
+MAX_BATCH_SIZE = 200  # ~60kb per request, under the server's 100kb JSON body limit
+MAX_PENDING = 7200  # Max queued points (~1 hour at 0.5s); oldest are dropped beyond this
+RETRY_BACKOFF = 1  # Initial per-batch retry delay in seconds, doubled per attempt
+RETRY_BACKOFF_MAX = 60  # Cap on per-batch retry delay
+SEQ_BLOCK = 1000  # Sequence numbers reserved per write of the seq state file
 
 
 class RaspiGPSSender:
     """Raspberry Pi GPS Coordinate Sender"""
     
-    def __init__(self, connection_string, baud_rate, drone_id, api_url, send_interval, verbose=False):
+    def __init__(self, connection_string, baud_rate, drone_id, api_url, send_interval, verbose=False,
+                 window=UPLOAD_WINDOW, batch_size=BATCH_SIZE, max_pending=MAX_PENDING, state_file=None):
         self.connection_string = connection_string
         self.baud_rate = baud_rate
         self.drone_id = drone_id
         self.api_url = api_url
+        self.batch_url = api_url.rstrip('/') + '/batch'
         self.send_interval = send_interval
         self.verbose = verbose
         self.vehicle = None
         self.running = False
-        self.total_sent = 0
-        self.total_failed = 0
+        self.total_queued = 0  # Points sampled and queued for upload
+        self.total_sent = 0  # Points acknowledged by the server
+        self.total_rejected = 0  # Points in batches the server refused (4xx)
+        self.total_dropped = 0  # Points dropped because the queue was full
+        self.failed_attempts = 0  # Batch requests that did not succeed
         self.connection_attempts = 0
         
+        # Sequence numbers are monotonic per drone across restarts: a block of
+        # SEQ_BLOCK numbers is reserved in the state file before use. The
+        # random session suffix keeps fix IDs unique even if the file is lost.
+        self.state_file = state_file or os.path.expanduser(f"~/.raspi_gps_sender_{drone_id}.seq")
+        self.session_id = uuid.uuid4().hex[:8]
+        saved_seq = self.load_seq_state()
+        self.seq_state_ok = saved_seq is not None
+        self.next_seq = saved_seq or 0
+        self.seq_reserved = self.next_seq
+        
+        # Upload pipeline state
+        self.window = max(1, window)
+        self.batch_size = min(max(1, batch_size), MAX_BATCH_SIZE)
+        self.max_pending = max(1, max_pending)
+        self.pending = deque()  # New points waiting to be sent
+        self.retry_queue = deque()  # Failed batches waiting for their backoff to expire
+        self.retry_points = 0  # Points held in retry_queue
+        self.in_flight = {}  # fixId -> point, sent but not yet acked
+        self.batches_in_flight = 0
+        self.legacy_server_warned = False
+        self.last_success_time = time.time()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.window)
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.window)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self.http.headers.update({'User-Agent': f'RaspiGPSSender/{self.drone_id}'})
+        
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -169,53 +215,272 @@ class RaspiGPSSender:
             self.log(f"⚠️  Error reading GPS: {e}", "WARNING")
             return None
     
-    def send_to_api(self, gps_data):
-        """Send GPS data to backend API"""
+    def load_seq_state(self):
+        """Read the next free sequence number from the state file
+        
+        Returns 0 when the file does not exist yet (first run) and None when
+        it exists but cannot be read, since restarting at 0 would repeat seqs.
+        """
         try:
-            payload = {
-                'latitude': gps_data['latitude'],
-                'longitude': gps_data['longitude'],
-                'altitude': gps_data['altitude'],
-                'heading': gps_data['heading'],
-                'speed': gps_data['speed'],
-                'timestamp': gps_data['timestamp']
-            }
+            with open(self.state_file) as f:
+                value = int(f.read().strip())
+            if value < 0:
+                raise ValueError(f"negative value {value}")
+            return value
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            self.log(f"❌ Could not read seq state {self.state_file}: {e}", "ERROR")
+            return None
+    
+    def save_seq_state(self, value):
+        """Atomically persist the sequence number watermark"""
+        tmp_path = f"{self.state_file}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(str(value))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_file)
+            return True
+        except OSError as e:
+            self.log(f"❌ Could not save seq state {self.state_file}: {e} "
+                     f"(seq may repeat after a restart)", "ERROR")
+            return False
+    
+    def reserve_seq_block(self):
+        """Persist a new block of sequence numbers before handing them out"""
+        self.seq_reserved = self.next_seq + SEQ_BLOCK
+        return self.save_seq_state(self.seq_reserved)
+    
+    def allocate_seq(self):
+        """Return the next sequence number, reserving a new block when needed"""
+        if self.next_seq >= self.seq_reserved:
+            self.reserve_seq_block()
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+    
+    def enqueue(self, gps_data):
+        """Tag a GPS fix with a sequence number and fix ID and queue it for upload"""
+        seq = self.allocate_seq()
+        point = {
+            'droneId': self.drone_id,
+            'seq': seq,
+            'fixId': f"{self.drone_id}:{seq}:{self.session_id}",
+            'latitude': gps_data['latitude'],
+            'longitude': gps_data['longitude'],
+            'altitude': gps_data['altitude'],
+            'heading': gps_data['heading'],
+            'speed': gps_data['speed'],
+            'timestamp': gps_data['timestamp']
+        }
+        with self.lock:
+            if len(self.pending) + self.retry_points >= self.max_pending:
+                self.drop_oldest()
+            self.pending.append(point)
+            self.total_queued += 1
+        return point
+    
+    def drop_oldest(self):
+        """Drop the oldest queued point to bound memory; caller holds the lock"""
+        if self.retry_queue:
+            batch = self.retry_queue[0]
+            batch['points'].pop(0)
+            self.retry_points -= 1
+            if not batch['points']:
+                self.retry_queue.popleft()
+        else:
+            self.pending.popleft()
+        self.total_dropped += 1
+        if self.total_dropped == 1 or self.total_dropped % 100 == 0:
+            self.log(f"⚠️  Upload queue full ({self.max_pending} points), "
+                     f"dropped {self.total_dropped} oldest points so far", "WARNING")
+    
+    def next_batch(self):
+        """Pick the next batch to send: a due retry first, then new points; caller holds the lock"""
+        now = time.monotonic()
+        for batch in self.retry_queue:
+            if batch['ready_at'] <= now:
+                self.retry_queue.remove(batch)
+                self.retry_points -= len(batch['points'])
+                return batch
+        
+        if self.pending:
+            points = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            return {'points': points, 'attempts': 0, 'ready_at': now}
+        
+        return None
+    
+    def dispatch(self):
+        """Fill the upload window with retried and new batches"""
+        with self.lock:
+            while self.batches_in_flight < self.window:
+                batch = self.next_batch()
+                if batch is None:
+                    break
+                for point in batch['points']:
+                    self.in_flight[point['fixId']] = point
+                self.batches_in_flight += 1
+                self.executor.submit(self.upload_batch, batch)
+    
+    def upload_batch(self, batch):
+        """Upload one batch and record acks; runs on a worker thread"""
+        points = batch['points']
+        status, acked, message = self.send_to_api(points)
+        
+        with self.lock:
+            self.batches_in_flight -= 1
+            for point in points:
+                self.in_flight.pop(point['fixId'], None)
+            
+            delivered = [point for point in points if point['fixId'] in acked]
+            if status == 'too_large' and len(points) > 1:
+                # Split an oversized batch and resend both halves right away,
+                # ahead of other retries so point order is kept
+                middle = len(points) // 2
+                for half in (points[middle:], points[:middle]):
+                    self.retry_queue.appendleft({
+                        'points': half,
+                        'attempts': batch['attempts'],
+                        'ready_at': time.monotonic()
+                    })
+                self.retry_points += len(points)
+                unacked = []
+            elif status in ['rejected', 'too_large']:
+                # Resending a batch the server refuses will never succeed
+                unacked = []
+                self.total_rejected += len(points)
+            else:
+                unacked = [point for point in points if point['fixId'] not in acked]
+            
+            if status != 'ok':
+                self.failed_attempts += 1
+            elif delivered:
+                self.last_success_time = time.time()
+            
+            # Report roughly every 10 points (less verbose for production)
+            report = self.verbose or self.total_sent // 10 != (self.total_sent + len(delivered)) // 10
+            self.total_sent += len(delivered)
+            
+            if unacked:
+                # Retry with the same fix IDs so the server skips points it already
+                # stored, backing off exponentially per batch
+                attempts = batch['attempts'] + 1
+                delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** (attempts - 1))
+                self.retry_queue.append({
+                    'points': unacked,
+                    'attempts': attempts,
+                    'ready_at': time.monotonic() + delay
+                })
+                self.retry_points += len(unacked)
+            queued = len(self.pending) + self.retry_points
+        
+        if status == 'too_large' and len(points) > 1:
+            self.log(f"⚠️  Batch seq {points[0]['seq']}-{points[-1]['seq']} too large, "
+                     f"splitting {len(points)} points: {message}", "WARNING")
+        elif status in ['rejected', 'too_large']:
+            self.log(f"❌ Batch seq {points[0]['seq']}-{points[-1]['seq']} rejected, "
+                     f"dropping {len(points)} points: {message}", "ERROR")
+        elif unacked:
+            if status == 'ok':
+                message = f"{len(unacked)} points not acknowledged"
+            self.log(f"❌ Send failed: {message} (attempt {batch['attempts'] + 1}, "
+                     f"retry in {delay:.0f}s, queued: {queued})", "WARNING")
+        
+        if delivered and report:
+            last = delivered[-1]
+            self.log(
+                f"✅ Lat: {last['latitude']:.6f}, "
+                f"Lon: {last['longitude']:.6f}, "
+                f"Alt: {last['altitude']:.1f}m | "
+                f"Seq: {last['seq']}, Sent: {self.total_sent}, Queued: {queued}",
+                "SUCCESS"
+            )
+    
+    def send_to_api(self, batch):
+        """Send a batch of GPS points to the backend batch API
+        
+        Returns (status, acked_fix_ids, message) where status is 'ok',
+        'retry' (timeouts, network errors, 408/429/5xx) or 'rejected'
+        (any other 4xx, which will not succeed on resend), or 'too_large'
+        (413, resent as smaller batches). A 2xx reply
+        without 'acked' comes from a server that does not dedup, so the
+        whole batch is treated as acknowledged to avoid duplicate inserts.
+        """
+        try:
+            payload = {'logs': batch}
             
             if self.verbose:
-                self.log(f"📤 Sending: {payload}", "DEBUG")
+                self.log(f"📤 Sending seq {batch[0]['seq']}-{batch[-1]['seq']} ({len(batch)} points)", "DEBUG")
             
-            response = requests.post(
-                self.api_url,
+            response = self.http.post(
+                self.batch_url,
                 json=payload,
-                timeout=10,
-                headers={'User-Agent': f'RaspiGPSSender/{self.drone_id}'}
+                timeout=10
             )
             
             if response.status_code in [200, 201]:
-                self.total_sent += 1
-                return True, "OK"
-            else:
-                self.total_failed += 1
-                error_msg = f"HTTP {response.status_code}"
                 try:
-                    error_data = response.json()
-                    error_msg += f": {error_data.get('error', 'Unknown error')}"
-                except:
-                    pass
-                return False, error_msg
+                    data = response.json()
+                except ValueError:
+                    data = None
+                if isinstance(data, dict) and 'acked' in data:
+                    return 'ok', set(data['acked']), "OK"
+                
+                # A server without the fixId dedup route inserts every point it
+                # receives and replies without 'acked'; resending would store the
+                # batch again, so count it as delivered instead
+                if not self.legacy_server_warned:
+                    self.legacy_server_warned = True
+                    self.log("❌ Server reply has no 'acked' list; it does not dedup by fixId. "
+                             "Treating batches as delivered without retry - deploy the "
+                             "server update", "ERROR")
+                return 'ok', {point['fixId'] for point in batch}, "OK (legacy server)"
+            
+            error_msg = f"HTTP {response.status_code}"
+            try:
+                error_data = response.json()
+                error_msg += f": {error_data.get('error', 'Unknown error')}"
+            except:
+                pass
+            
+            if response.status_code == 413:
+                return 'too_large', set(), error_msg
+            if 400 <= response.status_code < 500 and response.status_code not in [408, 429]:
+                return 'rejected', set(), error_msg
+            return 'retry', set(), error_msg
                 
         except requests.exceptions.Timeout:
-            self.total_failed += 1
-            return False, "Timeout"
+            return 'retry', set(), "Timeout"
         except requests.exceptions.ConnectionError:
-            self.total_failed += 1
-            return False, "Network Error"
+            return 'retry', set(), "Network Error"
         except Exception as e:
-            self.total_failed += 1
-            return False, str(e)[:50]
+            return 'retry', set(), str(e)[:50]
+    
+    def unacked_count(self):
+        """Points sampled but not yet acknowledged, rejected or dropped"""
+        with self.lock:
+            return len(self.pending) + self.retry_points + len(self.in_flight)
+    
+    def flush(self, timeout=10):
+        """Drain queued and in-flight points before shutdown"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.unacked_count() == 0:
+                return True
+            self.dispatch()
+            time.sleep(0.1)
+        return False
     
     def run(self):
         """Main loop"""
+        # Sequence numbers must never repeat, so refuse to start without usable seq state
+        if not self.seq_state_ok or not self.reserve_seq_block():
+            self.log(f"❌ Seq state file {self.state_file} is unusable. Fix it to hold a number "
+                     f"above the last stored seq for {self.drone_id}, or pass --state-file", "ERROR")
+            return 1
+        
         # Connect to Pixhawk
         if not self.connect_vehicle():
             self.log("❌ Failed to connect to Pixhawk", "ERROR")
@@ -228,12 +493,12 @@ class RaspiGPSSender:
         self.log("="*70, "INFO")
         self.log(f"API Endpoint: {self.api_url}", "INFO")
         self.log(f"Send Interval: {self.send_interval}s", "INFO")
+        self.log(f"Upload Window: {self.window} batches x {self.batch_size} points", "INFO")
         self.log(f"Drone ID: {self.drone_id}", "INFO")
         self.log(f"Connection: {self.connection_string}", "INFO")
         self.log("="*70, "INFO")
         
-        consecutive_failures = 0
-        last_success_time = time.time()
+        self.last_success_time = time.time()
         
         try:
             while self.running:
@@ -241,47 +506,20 @@ class RaspiGPSSender:
                 gps_data = self.get_gps_data()
                 
                 if gps_data:
-                    # Send to API
-                    success, message = self.send_to_api(gps_data)
-                    
-                    if success:
-                        consecutive_failures = 0
-                        last_success_time = time.time()
-                        
-                        # Print status (less verbose for production)
-                        if self.verbose or self.total_sent % 10 == 0:
-                            self.log(
-                                f"✅ Lat: {gps_data['latitude']:.6f}, "
-                                f"Lon: {gps_data['longitude']:.6f}, "
-                                f"Alt: {gps_data['altitude']:.1f}m | "
-                                f"Sent: {self.total_sent}, Failed: {self.total_failed}",
-                                "SUCCESS"
-                            )
-                    else:
-                        consecutive_failures += 1
-                        self.log(f"❌ Send failed: {message} (failures: {consecutive_failures})", "WARNING")
-                        
-                        # If too many consecutive failures, try to reconnect
-                        if consecutive_failures >= 10:
-                            self.log("Too many failures, attempting to reconnect...", "WARNING")
-                            if self.vehicle:
-                                try:
-                                    self.vehicle.close()
-                                except:
-                                    pass
-                            self.vehicle = None
-                            if not self.connect_vehicle():
-                                self.log("Reconnection failed, exiting", "ERROR")
-                                break
-                            consecutive_failures = 0
+                    # Queue for upload; sampling never waits on the network
+                    self.enqueue(gps_data)
+                
+                # Keep the upload window full; upload failures back off per batch
+                # and never touch the Pixhawk connection
+                self.dispatch()
                 
                 # Check if vehicle disconnected
-                if time.time() - last_success_time > 60:
+                if time.time() - self.last_success_time > 60:
                     self.log("⚠️  No successful sends in 60 seconds, checking connection...", "WARNING")
                     try:
                         # Try to read something from vehicle to check connection
                         _ = self.vehicle.location
-                        last_success_time = time.time()
+                        self.last_success_time = time.time()
                     except:
                         self.log("Vehicle disconnected, attempting reconnect...", "ERROR")
                         if self.vehicle:
@@ -308,13 +546,23 @@ class RaspiGPSSender:
     def cleanup(self):
         """Clean up resources"""
         self.log("🧹 Cleaning up...", "INFO")
+        
+        if not self.flush():
+            self.log(f"⚠️  {self.unacked_count()} points not acknowledged", "WARNING")
+        self.executor.shutdown(wait=True)
+        
         self.log(f"📊 Final Statistics:", "INFO")
-        self.log(f"   Total Sent: {self.total_sent}", "INFO")
-        self.log(f"   Total Failed: {self.total_failed}", "INFO")
+        self.log(f"   Total Queued: {self.total_queued}", "INFO")
+        self.log(f"   Acknowledged: {self.total_sent}", "INFO")
+        self.log(f"   Rejected: {self.total_rejected}", "INFO")
+        self.log(f"   Dropped (queue full): {self.total_dropped}", "INFO")
+        self.log(f"   Unacknowledged: {self.unacked_count()}", "INFO")
+        self.log(f"   Failed Attempts: {self.failed_attempts}", "INFO")
+        self.log(f"   Last Seq: {self.next_seq - 1}", "INFO")
         
-        if self.total_sent + self.total_failed > 0:
-            success_rate = (self.total_sent / (self.total_sent + self.total_failed) * 100)
-            self.log(f"   Success Rate: {success_rate:.1f}%", "INFO")
+        if self.total_queued > 0:
+            delivery_rate = (self.total_sent / self.total_queued * 100)
+            self.log(f"   Delivery Rate: {delivery_rate:.1f}%", "INFO")
         
         if self.vehicle:
             try:
@@ -360,12 +608,13 @@ Quick Start:
 Advanced Usage:
   python3 raspi_gps_sender.py --connect /dev/ttyACM0 --drone-id my_drone
   python3 raspi_gps_sender.py --connect tcp:127.0.0.1:5760  # For SITL simulation
+  python3 raspi_gps_sender.py --window 8 --batch-size 50    # High-latency links
 
 The script will automatically:
   - Detect Pixhawk device (/dev/ttyACM0, /dev/ttyUSB0, or SITL)
   - Generate a drone ID based on hostname
   - Connect to https://server-drone.vercel.app/api/logs
-  - Send GPS data every 0.5 seconds
+  - Send GPS data every 0.5 seconds via pipelined batches to /api/logs/batch
         """
     )
     
@@ -379,11 +628,22 @@ The script will automatically:
                         help='Backend API URL')
     parser.add_argument('--interval', type=float, default=0.5,
                         help='Send interval in seconds (default: 0.5)')
+    parser.add_argument('--window', type=int, default=UPLOAD_WINDOW,
+                        help=f'Max upload batches in flight (default: {UPLOAD_WINDOW})')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'Max points per upload batch, 1-{MAX_BATCH_SIZE} (default: {BATCH_SIZE})')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING,
+                        help=f'Max queued points before the oldest are dropped (default: {MAX_PENDING})')
+    parser.add_argument('--state-file',
+                        help='File persisting the sequence number (default: ~/.raspi_gps_sender_<drone-id>.seq)')
     parser.add_argument('--verbose', action='store_true',
                         help='Enable verbose logging')
     
     args = parser.parse_args()
     
+    if not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f'--batch-size must be between 1 and {MAX_BATCH_SIZE}')
+    
     # Auto-detect connection if not specified
     if not args.connect:
         args.connect = auto_detect_device()
@@ -403,7 +663,11 @@ The script will automatically:
         drone_id=args.drone_id,
         api_url=args.api_url,
         send_interval=args.interval,
-        verbose=args.verbose
+        verbose=args.verbose,
+        window=args.window,
+        batch_size=args.batch_size,
+        max_pending=args.max_pending,
+        state_file=args.state_file
     )
     
     exit_code = sender.run()
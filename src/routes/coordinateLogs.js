@@ -3,25 +3,57 @@ import prisma from '../config/database.js';
 
 const router = express.Router();
 
+// Sequence numbers must fit the Int column; anything else is stored as null
+const parseSeq = (seq) => {
+  if (seq === undefined || seq === null || seq === '') {
+    return null;
+  }
+  const value = Number(seq);
+  return Number.isInteger(value) && value >= 0 && value <= 2147483647 ? value : null;
+};
+
 // 1. Create a single coordinate log entry
 router.post('/', async (req, res) => {
   try {
-    const { latitude, longitude, altitude, heading, speed, timestamp } = req.body;
+    const { latitude, longitude, altitude, heading, speed, timestamp, droneId, seq, fixId } = req.body;
 
     if (!latitude || !longitude) {
       return res.status(400).json({ error: 'Latitude and longitude are required' });
     }
 
-    const coordinateLog = await prisma.coordinateLogs.create({
-      data: {
-        latitude: parseFloat(latitude),
-        longitude: parseFloat(longitude),
-        altitude: altitude ? parseFloat(altitude) : null,
-        heading: heading ? parseFloat(heading) : null,
-        speed: speed ? parseFloat(speed) : null,
-        timestamp: timestamp ? new Date(timestamp) : new Date(),
-      },
-    });
+    const data = {
+      latitude: parseFloat(latitude),
+      longitude: parseFloat(longitude),
+      altitude: altitude ? parseFloat(altitude) : null,
+      heading: heading ? parseFloat(heading) : null,
+      speed: speed ? parseFloat(speed) : null,
+      timestamp: timestamp ? new Date(timestamp) : new Date(),
+      droneId: droneId || null,
+      seq: parseSeq(seq),
+      fixId: fixId ? String(fixId) : null,
+    };
+
+    let coordinateLog;
+    if (data.fixId) {
+      // A retried fix with a known fixId returns the stored row instead of inserting twice
+      try {
+        coordinateLog = await prisma.coordinateLogs.upsert({
+          where: { fixId: data.fixId },
+          update: {},
+          create: data,
+        });
+      } catch (error) {
+        // Concurrent retries of the same fix can race past the upsert lookup
+        if (error.code !== 'P2002') {
+          throw error;
+        }
+        coordinateLog = await prisma.coordinateLogs.findUnique({
+          where: { fixId: data.fixId },
+        });
+      }
+    } else {
+      coordinateLog = await prisma.coordinateLogs.create({ data });
+    }
 
     res.status(201).json({
       message: 'Coordinate log created successfully',
@@ -49,15 +81,24 @@ router.post('/batch', async (req, res) => {
       heading: log.heading ? parseFloat(log.heading) : null,
       speed: log.speed ? parseFloat(log.speed) : null,
       timestamp: log.timestamp ? new Date(log.timestamp) : new Date(),
+      droneId: log.droneId || null,
+      seq: parseSeq(log.seq),
+      fixId: log.fixId ? String(log.fixId) : null,
     }));
 
+    // Skip rows whose fixId is already stored so retried batches are idempotent
     const result = await prisma.coordinateLogs.createMany({
       data: formattedLogs,
+      skipDuplicates: true,
     });
 
+    const acked = formattedLogs.filter(log => log.fixId).map(log => log.fixId);
+
     res.status(201).json({
       message: 'Coordinate logs uploaded successfully',
       count: result.count,
+      duplicates: formattedLogs.length - result.count,
+      acked,
     });
   } catch (error) {
     console.error('Error uploading coordinate logs:', error);